@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import sh
+import fnmatch
+import json
+import os.path
+
+class ChangedPathIndex:
+    """maps commits to the paths they change, filled in bulk and cached in the git dir"""
+    def __init__(self, repo):
+        self.git = sh.git.bake(_cwd=repo)
+        self.cachedir = os.path.join(self.git('rev-parse', '--absolute-git-dir').strip(), 'tb3', 'changedpaths')
+        self.shards = {}
+    def __get_cachefile(self, prefix):
+        return os.path.join(self.cachedir, '%s.json' % prefix)
+    def __get_shard(self, commit):
+        # the cache is split by the first two hex digits, so a lookup reads and writes only a small part of it
+        prefix = commit[:2]
+        if not prefix in self.shards:
+            self.shards[prefix] = {}
+            if os.path.exists(self.__get_cachefile(prefix)):
+                with open(self.__get_cachefile(prefix), 'r') as f:
+                    self.shards[prefix] = json.load(f)
+        return self.shards[prefix]
+    def __save(self, prefix):
+        os.makedirs(self.cachedir, exist_ok=True)
+        cachefile = self.__get_cachefile(prefix)
+        tmpfile = '%s.%d' % (cachefile, os.getpid())
+        with open(tmpfile, 'w') as f:
+            json.dump(self.shards[prefix], f)
+        os.rename(tmpfile, cachefile)
+    def index_commits(self, commits):
+        missing = [commit for commit in commits if not commit in self.__get_shard(commit)]
+        if not len(missing):
+            return
+        # one diff-tree process for the whole batch, merges are compared to their first parent
+        # -z keeps paths unquoted, an empty field starts the next commit as paths are never empty
+        output = str(self.git('diff-tree', '--stdin', '-z', '-r', '--root', '--always', '--name-only', '--no-renames', '--diff-merges=first-parent', '--format=%x00%H', _in='\n'.join(missing)+'\n', _decode_errors='replace'))
+        (paths, next_is_commit) = (None, False)
+        for field in output.split('\0'):
+            if not len(field):
+                next_is_commit = True
+            elif next_is_commit:
+                next_is_commit = False
+                paths = self.__get_shard(field)[field] = []
+            else:
+                # the first path still carries the newline ending the commit header
+                if not len(paths) and field.startswith('\n'):
+                    field = field[1:]
+                paths.append(field)
+        for prefix in set((commit[:2] for commit in missing)):
+            self.__save(prefix)
+    def index_range(self, begin, end):
+        self.index_commits([c for c in self.git('rev-list', '%s..%s' % (begin, end)).split('\n') if len(c) == 40])
+    def get_changed_paths(self, commit):
+        self.index_commits([commit])
+        return self.__get_shard(commit)[commit]
+
+class PathFilter:
+    """decides if a commit can affect the build on a platform using glob patterns of irrelevant paths"""
+    def __init__(self, platform, repo, irrelevant_patterns):
+        self.platform = platform
+        self.irrelevant_patterns = irrelevant_patterns
+        self.index = ChangedPathIndex(repo)
+    @staticmethod
+    def from_rules_file(platform, repo, rulesfile):
+        # the rules file maps a platform (or '*' for all platforms) to a list of patterns
+        with open(rulesfile, 'r') as f:
+            rules = json.load(f)
+        return PathFilter(platform, repo, rules.get('*', []) + rules.get(platform, []))
+    def __is_irrelevant_path(self, path):
+        for pattern in self.irrelevant_patterns:
+            if fnmatch.fnmatch(path, pattern):
+                return True
+        return False
+    def is_relevant(self, commit):
+        for path in self.index.get_changed_paths(commit):
+            if not self.__is_irrelevant_path(path):
+                return True
+        return False
+    def filter_relevant(self, commits):
+        self.index.index_commits(commits)
+        return [commit for commit in commits if self.is_relevant(commit)]
+# vim: set et sw=4 ts=4:
@@ -0,0 +1,57 @@
+#! /usr/bin/env python3
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import collections
+
+class FairShare:
+    """weights proposals of scenarios by the builder time they got recently compared to their target share"""
+    def __init__(self, scenarios, window, now, shares={}, slas={}, max_weight=10.0, smoothing=0.1):
+        (self.scenarios, self.window, self.shares, self.slas) = (scenarios, window, shares, slas)
+        (self.max_weight, self.smoothing) = (max_weight, smoothing)
+        self.usage = collections.deque()
+        # a scenario without builds counts as served when we started
+        self.last_served = dict(((scenario, now) for scenario in scenarios))
+    def serve(self, scenario, started):
+        # a running build keeps its scenario fresh, so it is not preempted for being overdue itself
+        self.last_served[scenario] = started
+    def record(self, scenario, started, finished):
+        self.usage.append((scenario, started, finished))
+        self.last_served[scenario] = finished
+    def __expire(self, now):
+        while len(self.usage) and self.usage[0][2] < now - self.window:
+            self.usage.popleft()
+    def get_usage(self, now):
+        self.__expire(now)
+        usage = dict(((scenario, 0.0) for scenario in self.scenarios))
+        for (scenario, started, finished) in self.usage:
+            usage[scenario] = usage.get(scenario, 0.0) + (finished - max(started, now - self.window)).total_seconds()
+        return usage
+    def get_target_share(self, scenario):
+        # scenarios without a configured share get one unit each
+        total = sum((self.shares.get(s, 1.0) for s in self.scenarios))
+        return self.shares.get(scenario, 1.0) / total
+    def get_weight(self, scenario, now):
+        usage = self.get_usage(now)
+        total = sum(usage.values())
+        target = self.get_target_share(scenario)
+        actual = usage.get(scenario, 0.0) / total if total else target
+        weight = (target + self.smoothing) / (actual + self.smoothing)
+        return min(self.max_weight, max(1.0 / self.max_weight, weight))
+    def get_overdue(self, scenario, now):
+        # how many times the freshness sla a scenario waits beyond it, 0 while within
+        if not scenario in self.slas:
+            return 0.0
+        waiting = now - self.last_served[scenario]
+        if waiting <= self.slas[scenario]:
+            return 0.0
+        return waiting.total_seconds() / max(1.0, self.slas[scenario].total_seconds())
+    def get_priority(self, scenario, score, now):
+        # overdue scenarios come first, the most overdue leading, the rest by weighted score
+        return (self.get_overdue(scenario, now), score * self.get_weight(scenario, now))
+# vim: set et sw=4 ts=4:
@@ -0,0 +1,78 @@
+#! /usr/bin/env python3
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import sh
+import datetime
+import os
+import os.path
+import tb3.repostate
+
+class Metrics:
+    """collects samples and renders them in the prometheus text exposition format"""
+    def __init__(self):
+        self.metrics = []
+        self.samples = {}
+    def add(self, name, value, labels={}, help='', metrictype='gauge'):
+        if not name in self.samples:
+            self.metrics.append((name, help, metrictype))
+            self.samples[name] = []
+        self.samples[name].append((labels, value))
+    def __format_labels(self, labels):
+        if not len(labels):
+            return ''
+        escaped = [(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for (key, value) in sorted(labels.items())]
+        return '{%s}' % ','.join(['%s="%s"' % label for label in escaped])
+    def __str__(self):
+        result = ''
+        for (name, help, metrictype) in self.metrics:
+            result += '# HELP %s %s\n' % (name, help)
+            result += '# TYPE %s %s\n' % (name, metrictype)
+            for (labels, value) in self.samples[name]:
+                result += '%s%s %s\n' % (name, self.__format_labels(labels), repr(float(value)))
+        return result
+    def write_textfile(self, filename):
+        # written aside and renamed, so a scraper never sees a partial file
+        tmpfile = '%s.%d' % (filename, os.getpid())
+        with open(tmpfile, 'w') as f:
+            f.write(str(self))
+        os.rename(tmpfile, filename)
+
+class CoordinatorMetrics:
+    def __init__(self, platform, branch, repo, builder_window=datetime.timedelta(hours=24), pathfilter=None):
+        (self.platform, self.branch, self.builder_window, self.pathfilter) = (platform, branch, builder_window, pathfilter)
+        self.git = sh.git.bake('--no-pager', _cwd=repo)
+        self.repostate = tb3.repostate.RepoState(platform, branch, repo)
+        self.repostats = tb3.repostate.RepoStats(platform, branch, repo)
+    def __count_commits(self, begin, end):
+        return int(self.git('rev-list', '--count', '%s..%s' % (begin, end)))
+    def __commit_time(self, commit):
+        return datetime.datetime.utcfromtimestamp(int(self.git('log', '-1', '--format=%ct', commit).strip()))
+    def get_metrics(self, time, metrics=None):
+        if metrics is None:
+            metrics = Metrics()
+        labels = {'platform' : self.platform, 'branch' : self.branch}
+        unbuilt = self.repostate.get_unbuilt(self.pathfilter)
+        oldest_unbuilt_age = 0
+        if len(unbuilt):
+            oldest_unbuilt_age = (time - self.__commit_time(unbuilt[0])).total_seconds()
+        metrics.add('tb3_unbuilt_commits', len(unbuilt), labels, 'Number of commits on the branch newer than the last build.')
+        metrics.add('tb3_oldest_unbuilt_commit_age_seconds', max(0, oldest_unbuilt_age), labels, 'Age of the oldest commit on the branch newer than the last build.')
+        (last_good, first_bad) = (self.repostate.get_last_good(), self.repostate.get_first_bad())
+        bisect_range = 0
+        if last_good and first_bad:
+            bisect_range = max(0, self.__count_commits(last_good, first_bad)-1)
+        metrics.add('tb3_bisect_range_commits', bisect_range, labels, 'Number of untested commits between the last good and the first bad commit.')
+        stats = self.repostats.get()
+        metrics.add('tb3_running_builds', len(self.repostats.get_running(time)), labels, 'Number of builds currently running.')
+        now = tb3.repostate.RepoStats.to_timestamp(time)
+        builders = [b for (b, seen) in stats.get('builders', {}).items() if seen + self.builder_window.total_seconds() > now]
+        metrics.add('tb3_active_builders', len(builders), labels, 'Number of builders that reported within the builder window.')
+        metrics.add('tb3_flakiness', self.repostats.get_flakiness(), labels, 'Estimated chance of a build result being flipped by a rebuild.')
+        return metrics
+# vim: set et sw=4 ts=4:
@@ -8,6 +8,8 @@
 #
 
 import sh
+import copy
+import bisect
 import json
 import datetime
 
@@ -23,7 +25,7 @@ class StateDecoder(json.JSONDecoder):
     def decode(self, s):
         obj = super(StateDecoder, self).decode(s)
         for (key, value) in obj.items():
-            if isinstance(value, list):
+            if isinstance(value, list) and len(value):
                 if value[0] == '__datetime__':
                     obj[key] = datetime.datetime.utcfromtimestamp(value[1])
                 elif value[0] == '__timedelta__':
@@ -91,10 +93,157 @@ class RepoState:
         if self.git('merge-base', '--is-ancestor', last_good, last_bad, _ok_code=[0,1]).exit_code == 0:
             return last_bad
         return last_good
+    def get_unbuilt(self, pathfilter=None):
+        # oldest first, commits irrelevant for the platform never get built
+        (head, last_build) = (self.get_head(), self.get_last_build())
+        if not head:
+            return []
+        if not last_build:
+            return [head]
+        unbuilt = [c for c in self.git('rev-list', '--reverse', '%s..%s' % (last_build, head)).split('\n') if len(c) == 40]
+        if pathfilter:
+            unbuilt = pathfilter.filter_relevant(unbuilt)
+        return unbuilt
+
+class JsonRef:
+    """a json document kept as a blob behind a ref"""
+    def __init__(self, refname, repo):
+        self.git = sh.git.bake(_cwd=repo)
+        self.refname = refname
+    def __read(self):
+        try:
+            oid = self.git('rev-parse', '--verify', '-q', self.refname).strip()
+        except sh.ErrorReturnCode_1:
+            return (None, {})
+        return (oid, json.loads(str(self.git('cat-file', 'blob', oid))))
+    def get(self):
+        return self.__read()[1]
+    def update(self, modifier):
+        # compare-and-swap on the ref, retried when another writer got in between
+        for attempt in range(10):
+            (oid, stats) = self.__read()
+            modifier(stats)
+            newoid = self.git('hash-object', '-w', '--stdin', _in=json.dumps(stats, sort_keys=True)).strip()
+            try:
+                self.git('update-ref', self.refname, newoid, oid or '0'*40)
+                return stats
+            except sh.ErrorReturnCode_128:
+                pass
+        raise RuntimeError('could not update %s' % self.refname)
+
+class RepoStats(JsonRef):
+    """small aggregate record kept next to the state refs, so readers do not need to scan the history"""
+    def __init__(self, platform, branch, repo):
+        JsonRef.__init__(self, 'refs/tb3/state/%s/%s/stats' % (platform, branch), repo)
+    @staticmethod
+    def to_timestamp(time):
+        return (time - datetime.datetime(1970,1,1)).total_seconds()
+    def set_running(self, commit, builder, started, estimated_duration):
+        def modifier(stats):
+            stats.setdefault('running', {})[commit] = {
+                'builder' : builder,
+                'started' : RepoStats.to_timestamp(started),
+                'estimated_duration' : estimated_duration.total_seconds() }
+            stats.setdefault('builders', {})[builder] = RepoStats.to_timestamp(started)
+        return self.update(modifier)
+    def set_done(self, commit, builder, finished, previous_results=[], result=None):
+        def modifier(stats):
+            stats.setdefault('running', {}).pop(commit, None)
+            stats.setdefault('builders', {})[builder] = RepoStats.to_timestamp(finished)
+            # a rebuild that disagrees with an earlier result of the same commit is a flake
+            if result and len(previous_results):
+                stats['repeated_results'] = stats.get('repeated_results', 0) + 1
+                if [r for r in previous_results if r != result]:
+                    stats['flipped_results'] = stats.get('flipped_results', 0) + 1
+        return self.update(modifier)
+    def get_flakiness(self):
+        # estimated chance of a wrong build result, starting from 10% until rebuilds tell otherwise
+        stats = self.get()
+        return (stats.get('flipped_results', 0) + 1.0) / (stats.get('repeated_results', 0) + 10.0)
+    def get_running(self, time):
+        # builds running for more than twice their estimate are considered lost
+        now = RepoStats.to_timestamp(time)
+        running = self.get().get('running', {})
+        return dict((commit, run) for (commit, run) in running.items() if run['started'] + 2*run['estimated_duration'] > now)
+
+class RepoSummary(JsonRef):
+    """state counts and pointers of a branch, kept current by the updater so readers need a single lookup"""
+    def __init__(self, platform, branch, repo):
+        JsonRef.__init__(self, 'refs/tb3/state/%s/%s/summary' % (platform, branch), repo)
+    def add_transitions(self, transitions, time, fields, reset=False):
+        timestamp = RepoStats.to_timestamp(time)
+        def modifier(summary):
+            if reset:
+                summary['counts'] = {}
+            counts = summary.setdefault('counts', {})
+            last_transitions = summary.setdefault('last_transitions', {})
+            # commits without a note are UNKNOWN, those are counted as unbuilt instead
+            for (oldstate, newstate) in transitions:
+                if oldstate != 'UNKNOWN':
+                    counts[oldstate] = max(0, counts.get(oldstate, 0) - 1)
+                if newstate != 'UNKNOWN':
+                    counts[newstate] = counts.get(newstate, 0) + 1
+                last_transitions[newstate] = timestamp
+            summary.update(fields)
+            summary['updated'] = timestamp
+        return self.update(modifier)
+
+class ArtifactIndex(JsonRef):
+    """artifact references of built commits per result, sorted by first-parent position in one blob for a binary search"""
+    MAX_WALK = 1024
+    def __init__(self, platform, repo):
+        JsonRef.__init__(self, 'refs/tb3/artifacts/%s' % platform, repo)
+    def __get_position(self, index, commit):
+        # counts on from the nearest indexed commit and only counts the whole first-parent chain without one close by
+        known = dict(((entry[1], entry[0]) for entries in index.values() for entry in entries))
+        commits = [c for c in self.git('rev-list', '--first-parent', '--max-count=%d' % self.MAX_WALK, commit).split('\n') if len(c) == 40]
+        for (distance, candidate) in enumerate(commits):
+            if candidate in known:
+                return known[candidate] + distance
+        if len(commits) < self.MAX_WALK:
+            return len(commits)
+        return int(self.git('rev-list', '--count', '--first-parent', commit).strip())
+    def __insert(self, index, commit, state, artifactreference):
+        entries = [entry for entry in index.get(state, []) if entry[1] != commit]
+        bisect.insort(entries, [self.__get_position(index, commit), commit, artifactreference])
+        index[state] = entries
+    def add(self, commit, state, artifactreference):
+        commit = self.git('rev-parse', commit).strip()
+        self.update(lambda index: self.__insert(index, commit, state, artifactreference))
+    def get_nearest(self, commit, state):
+        index = self.get()
+        entries = index.get(state, [])
+        if not len(entries):
+            return None
+        commit = self.git('rev-parse', commit).strip()
+        position = self.__get_position(index, commit)
+        # artifacts of other branches sort in between, so check the candidates below the position for being on our first-parent chain
+        for top in range(bisect.bisect_left(entries, [position + 1]), 0, -32):
+            candidates = entries[max(0, top - 32):top][::-1]
+            ancestors = self.git('rev-parse', *['%s~%d' % (commit, position - entry[0]) for entry in candidates]).split()
+            for (entry, ancestor) in zip(candidates, ancestors):
+                if entry[1] == ancestor:
+                    return (entry[1], entry[2])
+        return None
+    def import_tags(self, binrepo, prefix='source-hash-'):
+        # the bibisect binrepo tags every successful build with the source commit
+        tagged = []
+        for line in self.git('ls-remote', binrepo, 'refs/tags/%s*' % prefix).split('\n'):
+            if not len(line) or line.endswith('^{}'):
+                continue
+            tag = line.split('\t')[1][len('refs/tags/'):]
+            commit = tag[len(prefix):]
+            if self.git('cat-file', '-e', '%s^{commit}' % commit, _ok_code=[0,1,128]).exit_code == 0:
+                tagged.append((self.git('rev-parse', commit).strip(), tag))
+        def add_tagged(index):
+            for (commit, tag) in tagged:
+                self.__insert(index, commit, 'GOOD', tag)
+        self.update(add_tagged)
+        return len(tagged)
 
 class CommitState:
     STATES=['BAD', 'GOOD', 'ASSUMED_GOOD', 'ASSUMED_BAD', 'POSSIBLY_BREAKING', 'POSSIBLY_FIXING', 'UNKNOWN', 'RUNNING', 'BREAKING']
-    def __init__(self, state='UNKNOWN', started=None, builder=None, estimated_duration=None, finished=None, artifactreference=None):
+    def __init__(self, state='UNKNOWN', started=None, builder=None, estimated_duration=None, finished=None, artifactreference=None, results=None, previous_state=None):
         if not state in CommitState.STATES:
             raise AttributeError
         self.state = state
@@ -103,6 +252,24 @@ class CommitState:
         self.finished = finished
         self.estimated_duration = estimated_duration
         self.artifactreference = artifactreference
+        # every result ever reported for the commit as [state, builder, finished timestamp]
+        self.results = results
+        # the state of a running commit before it was scheduled
+        self.previous_state = previous_state
+    def get_result_counts(self):
+        results = [r[0] for r in self.results or []]
+        return (results.count('GOOD'), results.count('BAD'))
+    def get_confidence(self, flakiness, state=None):
+        # probability that a GOOD/BAD/BREAKING state is not only the outcome of flaky builds
+        if state is None:
+            state = self.state
+        if not self.results or not state in ['GOOD', 'BAD', 'BREAKING']:
+            return 1.0
+        (good, bad) = self.get_result_counts()
+        agreeing = good
+        if state != 'GOOD':
+            agreeing = bad
+        return (1.0 - flakiness**agreeing) * agreeing / (good + bad)
     def __eq__(self, other):
         if not hasattr(other, '__dict__'):
             return False
@@ -113,36 +280,124 @@ class CommitState:
             result += ' (took %s)' % (self.finished-self.started)
         if self.estimated_duration:
             result += ' (estimated %s)' % (self.estimated_duration)
+        if self.results and len(self.results) > 1:
+            result += ' (results: %s)' % ', '.join([r[0] for r in self.results])
         return result
 
 class RepoHistory:
     def __init__(self, platform, repo):
         self.platform = platform
         self.git = sh.git.bake(_cwd=repo)
-        self.gitnotes = sh.git.bake('--no-pager', 'notes', '--ref', 'core.notesRef=refs/notes/tb3/history/%s' % self.platform, _cwd=repo)
+        # git notes --ref expands its argument below refs/notes/, so this is where existing histories live
+        self.notesref = 'refs/notes/core.notesRef=refs/notes/tb3/history/%s' % self.platform
+        self.gitnotes = sh.git.bake('--no-pager', 'notes', '--ref', self.notesref, _cwd=repo)
     def get_commit_state(self, commit):
         commitstate_json = str(self.gitnotes.show(commit, _ok_code=[0,1]))
         commitstate = CommitState()
         if len(commitstate_json):
-            commitstate.__dict__ = json.loads(commitstate_json, cls=StateDecoder)
+            # notes written before a field existed keep its default
+            commitstate.__dict__.update(json.loads(commitstate_json, cls=StateDecoder))
         return commitstate
     def get_recent_commit_states(self, branch, count):
         commits = self.git('rev-list', '%s~%d..%s' % (branch, count, branch)).split('\n')[:-1]
         return [(c, self.get_commit_state(c)) for c in commits]
     def set_commit_state(self, commit, commitstate):
         self.gitnotes.add(commit, force=True, m=json.dumps(commitstate.__dict__, cls=StateEncoder)) 
+    def compact(self, archive=False):
+        # squash the notes history into one parentless commit with the same notes tree
+        for attempt in range(10):
+            try:
+                oldtip = self.git('rev-parse', '--verify', '-q', self.notesref).strip()
+            except sh.ErrorReturnCode_1:
+                return None
+            tree = self.git('rev-parse', '%s^{tree}' % oldtip).strip()
+            newtip = self.git('commit-tree', tree, m='tb3: compacted history for %s' % self.platform).strip()
+            if archive:
+                archiveref = 'refs/tb3/archive/history/%s/%s' % (self.platform, oldtip)
+                self.git('update-ref', archiveref, oldtip)
+            try:
+                # only swap if no builder added a note meanwhile, otherwise try again with the new tip
+                self.git('update-ref', self.notesref, newtip, oldtip)
+                if not archive:
+                    # the reflog would keep the old history reachable for gc
+                    self.git('reflog', 'expire', '--expire=now', '--expire-unreachable=now', self.notesref)
+                return newtip
+            except sh.ErrorReturnCode_128:
+                if archive:
+                    self.git('update-ref', '-d', archiveref)
+        raise RuntimeError('could not compact %s' % self.notesref)
     def update_inner_range_state(self, begin, end, commitstate, skipstates):
+        transitions = []
         for commit in self.git('rev-list', '%s..%s' % (begin, end)).split('\n')[1:-1]:
             oldstate = self.get_commit_state(commit)
             if not oldstate.state in skipstates:
-                self.set_commit_state(commit, commitstate)
+                newstate = copy.copy(commitstate)
+                newstate.results = oldstate.results
+                self.set_commit_state(commit, newstate)
+                transitions.append((commit, oldstate.state, newstate.state))
+        return transitions
 
 class RepoStateUpdater:
-    def __init__(self, platform, branch, repo):
-        (self.platform, self.branch) = (platform, branch)
+    def __init__(self, platform, branch, repo, pathfilter=None):
+        (self.platform, self.branch, self.pathfilter) = (platform, branch, pathfilter)
         self.git = sh.git.bake(_cwd=repo)
         self.repostate = RepoState(platform, branch, repo)
         self.repohistory = RepoHistory(platform, repo)
+        self.repostats = RepoStats(platform, branch, repo)
+        self.artifactindex = ArtifactIndex(platform, repo)
+        self.reposummary = RepoSummary(platform, branch, repo)
+        self.transitions = []
+    def __set_commit_state(self, commit, oldstate, commitstate):
+        self.repohistory.set_commit_state(commit, commitstate)
+        if len(commit) != 40:
+            commit = self.git('rev-parse', commit).strip()
+        self.transitions.append((commit, oldstate, commitstate.state))
+    def __get_summary_branches(self):
+        prefix = 'refs/tb3/state/%s/' % self.platform
+        branches = set([self.branch])
+        for refname in self.git('for-each-ref', '--format=%(refname)', prefix).split():
+            if refname.endswith('/summary'):
+                branches.add(refname[len(prefix):-len('/summary')])
+        return sorted(branches)
+    def __get_summary_fields(self):
+        (last_good, first_bad, last_bad) = (self.repostate.get_last_good(), self.repostate.get_first_bad(), self.repostate.get_last_bad())
+        breaking = None
+        if first_bad and self.repohistory.get_commit_state(first_bad).state == 'BREAKING':
+            breaking = first_bad
+        return {
+            'last_good' : last_good,
+            'first_bad' : first_bad,
+            'last_bad' : last_bad,
+            'breaking' : breaking }
+    def __save_summary(self):
+        (transitions, self.transitions) = (self.transitions, [])
+        now = datetime.datetime.now()
+        # the notes are shared by all branches of the platform, so a transition counts on every branch containing the commit
+        commits = set((commit for (commit, oldstate, newstate) in transitions))
+        for branch in self.__get_summary_branches():
+            contained = transitions
+            if len(commits):
+                outside = set(self.git('rev-list', '--stdin', '^%s' % branch, _in='\n'.join(commits)+'\n').split())
+                contained = [t for t in transitions if not t[0] in outside]
+            if branch == self.branch:
+                self.reposummary.add_transitions([t[1:] for t in contained], now, self.__get_summary_fields())
+            elif len(contained):
+                RepoSummary(self.platform, branch, self.repostate.repo).add_transitions([t[1:] for t in contained], now, {})
+    def get_summary(self):
+        # the head moves on every sync without a transition, so what depends on it is never stored
+        summary = self.reposummary.get()
+        unbuilt = self.repostate.get_unbuilt(self.pathfilter)
+        summary.update({
+            'head' : self.repostate.get_head(),
+            'unbuilt' : len(unbuilt),
+            'oldest_unbuilt' : unbuilt[0] if len(unbuilt) else None })
+        return summary
+    def rebuild_summary(self):
+        # recounts the states of all noted commits on the branch, for histories older than the summary
+        noted = set((line.split(' ')[1] for line in self.repohistory.gitnotes.list().split('\n') if len(line)))
+        states = [self.repohistory.get_commit_state(c).state for c in self.git('rev-list', self.branch).split('\n') if c in noted]
+        self.transitions = []
+        self.reposummary.add_transitions([('UNKNOWN', state) for state in states], datetime.datetime.now(), self.__get_summary_fields(), True)
     def __update(self, commit, last_good_state, last_bad_state, forward, bisect_state):
         last_build = self.repostate.get_last_build()
         last_good = self.repostate.get_last_good()
@@ -151,7 +406,7 @@ class RepoStateUpdater:
                 rangestate = last_bad_state
                 if last_build == last_good:
                     rangestate = last_good_state
-                self.repohistory.update_inner_range_state(last_build, commit, CommitState(rangestate), ['GOOD', 'BAD', 'BREAKING'])
+                self.transitions += self.repohistory.update_inner_range_state(last_build, commit, CommitState(rangestate), ['GOOD', 'BAD', 'BREAKING'])
             else:
                 first_bad = self.repostate.get_first_bad()
                 assert(self.git('merge-base', '--is-ancestor', last_good, commit, _ok_code=[0,1]).exit_code == 0)
@@ -159,7 +414,33 @@ class RepoStateUpdater:
                 assume_range = (last_good, commit)
                 if forward:
                     assume_range = (commit, first_bad)
-                self.repohistory.update_inner_range_state(assume_range[0], assume_range[1], CommitState(bisect_state), ['GOOD', 'BAD', 'BREAKING'])
+                self.transitions += self.repohistory.update_inner_range_state(assume_range[0], assume_range[1], CommitState(bisect_state), ['GOOD', 'BAD', 'BREAKING'])
+    def __only_irrelevant_between(self, last_good, first_bad):
+        if not self.pathfilter:
+            return False
+        if self.git('merge-base', '--is-ancestor', last_good, first_bad, _ok_code=[0,1]).exit_code != 0:
+            return False
+        between = [c for c in self.git('rev-list', '%s..%s^' % (last_good, first_bad)).split('\n') if len(c) == 40]
+        if len(self.pathfilter.filter_relevant(between)):
+            return False
+        # these commits cannot change the result, so they build like last_good
+        for commit in between:
+            oldstate = self.repohistory.get_commit_state(commit)
+            self.__set_commit_state(commit, oldstate.state, CommitState('ASSUMED_GOOD', results=oldstate.results))
+        return True
+    def __assume_irrelevant_after(self, commit, state):
+        if not self.pathfilter:
+            return
+        # irrelevant commits on top of a build are never proposed, but build like it
+        later = self.git('rev-list', '--reverse', '--ancestry-path', '%s..%s' % (commit, self.branch)).split()
+        self.pathfilter.index.index_commits(later)
+        for laterc in later:
+            if self.pathfilter.is_relevant(laterc):
+                return
+            oldstate = self.repohistory.get_commit_state(laterc)
+            if oldstate.state in ['GOOD', 'BAD', 'BREAKING', 'RUNNING']:
+                return
+            self.__set_commit_state(laterc, oldstate.state, CommitState('ASSUMED_%s' % state, results=oldstate.results))
     def __finalize_bisect(self):
         (first_bad, last_bad) = (self.repostate.get_first_bad(), self.repostate.get_last_bad())
         if not first_bad:
@@ -169,32 +450,67 @@ class RepoStateUpdater:
         if not last_good:
             #assert(self.repostate.get_last_bad() is None)
             return
-        if last_good in self.git('rev-list', first_bad, max_count=2).split()[1:]:
+        if last_good in self.git('rev-list', first_bad, max_count=2).split()[1:] or self.__only_irrelevant_between(last_good, first_bad):
             commitstate = self.repohistory.get_commit_state(first_bad)
+            oldstate = commitstate.state
             commitstate.state = 'BREAKING'
-            self.repohistory.set_commit_state(first_bad, commitstate)
+            self.__set_commit_state(first_bad, oldstate, commitstate)
         if self.git('merge-base', '--is-ancestor', last_bad, last_good, _ok_code=[0,1]).exit_code == 0:
             self.repostate.clear_first_bad()
             self.repostate.clear_last_bad()
+    def __is_refuted_failure(self, commit, results):
+        if not 'BAD' in results or results.count('GOOD') < results.count('BAD'):
+            return False
+        if self.repostate.get_first_bad() != commit or self.repostate.get_last_bad() != commit:
+            return False
+        # later failures on the branch back the failure up
+        later = self.git('rev-list', '--reverse', '--ancestry-path', '%s..%s' % (commit, self.branch)).split()
+        return not len(later) or not self.repohistory.get_commit_state(later[0]).state in ['BAD', 'ASSUMED_BAD', 'BREAKING']
     def set_scheduled(self, commit, builder, estimated_duration):
         # FIXME: dont hardcode limit
         estimated_duration = min(estimated_duration, datetime.timedelta(hours=4))
-        commitstate = CommitState('RUNNING', datetime.datetime.now(), builder, estimated_duration)
-        self.repohistory.set_commit_state(commit, commitstate)
-    def set_finished(self, commit, builder, state, artifactreference):
+        oldstate = self.repohistory.get_commit_state(commit)
+        # kept to go back to when the build is preempted
+        previous_state = oldstate.previous_state if oldstate.state == 'RUNNING' else oldstate.state
+        commitstate = CommitState('RUNNING', datetime.datetime.now(), builder, estimated_duration, results=oldstate.results, previous_state=previous_state)
+        self.__set_commit_state(commit, oldstate.state, commitstate)
+        self.repostats.set_running(commit, builder, commitstate.started, estimated_duration)
+        self.__save_summary()
+    def set_preempted(self, commit, builder):
+        commitstate = self.repohistory.get_commit_state(commit)
+        self.repostats.set_done(commit, builder, datetime.datetime.now())
+        # the build was stopped for more important work, the commit can be scheduled again
+        if commitstate.state == 'RUNNING' and commitstate.builder == builder:
+            self.__set_commit_state(commit, commitstate.state, CommitState(commitstate.previous_state or 'UNKNOWN', results=commitstate.results))
+            self.__save_summary()
+    def set_finished(self, commit, builder, state, artifactreference, index_artifact=False):
         if not state in ['GOOD', 'BAD']:
             raise AttributeError
         commitstate = self.repohistory.get_commit_state(commit)
+        oldstate = commitstate.state
+        commitstate.previous_state = None
+        finished = datetime.datetime.now()
+        previous_results = [r[0] for r in commitstate.results or []]
+        self.repostats.set_done(commit, builder, finished, previous_results, state)
+        commitstate.results = (commitstate.results or []) + [[state, builder, RepoStats.to_timestamp(finished)]]
         #assert(commitstate.state == 'RUNNING')
         #assert(commitstate.builder == builder)
+        # build logs and the 'null' of clients without a logdir are no artifacts to bisect with
+        if index_artifact and artifactreference and artifactreference != 'null':
+            self.artifactindex.add(commit, state, artifactreference)
+        refuted_failure = state == 'GOOD' and self.__is_refuted_failure(commit, previous_results + [state])
+        if refuted_failure:
+            # a lone failure not confirmed by rebuilds is a flake, no reason to bisect for it
+            self.repostate.clear_first_bad()
+            self.repostate.clear_last_bad()
         # we want to keep a failure around, even if we have a success somehow
-        if not commitstate.state in ['BAD'] or state in ['BAD']:
+        if state in ['BAD'] or not (commitstate.state in ['BAD'] or 'BAD' in previous_results) or refuted_failure:
             commitstate.state = state
             commitstate.finished = datetime.datetime.now()
             commitstate.builder = builder
             commitstate.estimated_duration = None
             commitstate.artifactreference = artifactreference
-            self.repohistory.set_commit_state(commit, commitstate)
+            self.__set_commit_state(commit, oldstate, commitstate)
             if state == 'GOOD':
                 last_good = self.repostate.get_last_good()
                 if last_good:
@@ -208,5 +524,11 @@ class RepoStateUpdater:
                     self.repostate.set_first_bad(commit)
                 if not last_bad:
                     self.repostate.set_last_bad(commit)
+            self.__assume_irrelevant_after(commit, state)
+            self.__finalize_bisect()
+        else:
+            commitstate.state = 'BAD'
+            self.__set_commit_state(commit, oldstate, commitstate)
             self.__finalize_bisect()
+        self.__save_summary()
 # vim: set et sw=4 ts=4:
@@ -13,6 +13,9 @@ import tb3.repostate
 import functools
 import datetime
 
+# a failure is rebuilt at most once, after that it stands as kept by the updater
+CONFIRM_RESULTS = 2
+
 class Proposal:
     def __init__(self, score, commit, scheduler, platform, repo, branch):
         (self.score, self.commit, self.scheduler, self.platform, self.repo, self.branch) = (score, commit, scheduler, platform, repo, branch)
@@ -22,12 +25,14 @@ class Proposal:
         return self.score < other.score
 
 class Scheduler:
-    def __init__(self, platform, branch, repo):
+    def __init__(self, platform, branch, repo, pathfilter=None):
         self.branch = branch
         self.repo = repo
         self.platform = platform
+        self.pathfilter = pathfilter
         self.repostate = tb3.repostate.RepoState(self.platform, self.branch, self.repo)
         self.repohistory = tb3.repostate.RepoHistory(self.platform, self.repo)
+        self.repostats = tb3.repostate.RepoStats(self.platform, self.branch, self.repo)
         self.git = sh.git.bake(_cwd=repo)
     def make_proposal(self, score, commit):
         return Proposal(score, commit, self.__class__.__name__, self.platform, self.repo, self.branch)
@@ -35,10 +40,20 @@ class Scheduler:
         return int(self.git('rev-list', '%s..%s' % (start, to), count=True))
     def get_commits(self, begin, end):
         commits = []
-        for commit in self.git('rev-list', '%s..%s' % (begin, end)).strip('\n').split('\n'):
-            if len(commit) == 40:
-                commits.append( (len(commits), commit, self.repohistory.get_commit_state(commit)) )
+        candidates = [c for c in self.git('rev-list', '%s..%s' % (begin, end)).strip('\n').split('\n') if len(c) == 40]
+        if self.pathfilter:
+            candidates = self.pathfilter.filter_relevant(candidates)
+        for commit in candidates:
+            commits.append( (len(commits), commit, self.repohistory.get_commit_state(commit)) )
         return commits
+    def is_bisecting(self, last_good, first_bad, commits):
+        # a failure is only worth confirming before any bisection step was reported
+        if self.repostate.get_last_bad() != first_bad:
+            return True
+        (good_results, bad_results) = (self.repohistory.get_commit_state(last_good).results, self.repohistory.get_commit_state(first_bad).results)
+        if good_results and bad_results and good_results[-1][2] > bad_results[0][2]:
+            return True
+        return len([commit for commit in commits if commit[2].results]) > 0
     def norm_results(self, proposals, offset):
         maxscore = 0
         #maxscore = functools.reduce( lambda x,y: max(x.score, y.score), proposals)
@@ -80,8 +95,8 @@ class HeadScheduler(Scheduler):
         return proposals
 
 class BisectScheduler(Scheduler):
-    def __init__(self, platform, branch, repo):
-        Scheduler.__init__(self, platform, branch, repo)
+    def __init__(self, platform, branch, repo, pathfilter=None):
+        Scheduler.__init__(self, platform, branch, repo, pathfilter)
     def get_proposals(self, time):
         last_good = self.repostate.get_last_good()
         first_bad = self.repostate.get_first_bad()
@@ -95,8 +110,34 @@ class BisectScheduler(Scheduler):
             proposals[idx].score *= (1-1/(float(idx+0.5)**2+1)) * (1-1/((float(idx+0.5-len(proposals)))**2+1))
         reduce_all = self.dampen_running_commits(commits, proposals, time)
         self.norm_results(proposals, reduce_all)
+        # bisecting a flaky failure wastes builds, unless it was confirmed or bisection is under way
+        commitstate = self.repohistory.get_commit_state(first_bad)
+        confidence = 1.0
+        if len(commitstate.results or []) < CONFIRM_RESULTS and not self.is_bisecting(last_good, first_bad, commits):
+            confidence = commitstate.get_confidence(self.repostats.get_flakiness(), 'BAD')
+        for proposal in proposals:
+            proposal.score *= confidence
         return proposals
 
+class ConfirmScheduler(Scheduler):
+    def __init__(self, platform, branch, repo, pathfilter=None, min_confidence=0.95):
+        Scheduler.__init__(self, platform, branch, repo, pathfilter)
+        self.min_confidence = min_confidence
+    def get_proposals(self, time):
+        last_good = self.repostate.get_last_good()
+        first_bad = self.repostate.get_first_bad()
+        if last_good is None or first_bad is None:
+            return []
+        commitstate = self.repohistory.get_commit_state(first_bad)
+        if commitstate.state == 'RUNNING' or len(commitstate.results or []) >= CONFIRM_RESULTS:
+            return []
+        if self.is_bisecting(last_good, first_bad, self.get_commits(last_good, '%s^' % first_bad)):
+            return []
+        if commitstate.get_confidence(self.repostats.get_flakiness(), 'BAD') >= self.min_confidence:
+            return []
+        # worth more than any single bisect step, as it might save the whole bisection
+        return [self.make_proposal(float(self.count_commits(last_good, first_bad)+1), first_bad)]
+
 class MergeScheduler(Scheduler):
     def __init__(self, platform, branch, repo):
         Scheduler.__init__(self, platform, branch, repo)
@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import sh
+import sys
+import json
+import tb3.repostate
+
+class ShardMap:
+    """assigns each platform to the coordinator shard owning its state and history refs"""
+    def __init__(self, shards, platforms):
+        (self.shards, self.platforms) = (shards, platforms)
+    @staticmethod
+    def from_file(filename):
+        # {"shards": {"<shard>": "<repo>", ...}, "platforms": {"<platform>": "<shard>", "*": "<shard>"}}
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        return ShardMap(data['shards'], data['platforms'])
+    def get_platforms(self):
+        return sorted([platform for platform in self.platforms.keys() if platform != '*'])
+    def get_owner(self, platform):
+        if platform in self.platforms:
+            return self.platforms[platform]
+        return self.platforms['*']
+    def get_repo(self, platform):
+        return self.shards[self.get_owner(platform)]
+    def get_refs(self, platform):
+        # the notes history is per platform, so a platform is the smallest unit a shard can own
+        return ['refs/tb3/state/%s/' % platform, tb3.repostate.RepoHistory(platform, '.').notesref, 'refs/tb3/artifacts/%s' % platform]
+
+class Replicator:
+    def __init__(self, shard, repo, shardmap):
+        (self.shard, self.shardmap) = (shard, shardmap)
+        self.git = sh.git.bake(_cwd=repo)
+    def is_owner(self, platform):
+        return self.shardmap.get_owner(platform) == self.shard
+    def __list_remote_refs(self, remote, refs):
+        existing = []
+        patterns = [ref + '*' if ref.endswith('/') else ref for ref in refs]
+        for line in self.git('ls-remote', remote, *patterns).split('\n'):
+            if len(line):
+                refname = line.split('\t')[1]
+                if [ref for ref in refs if refname == ref or (ref.endswith('/') and refname.startswith(ref))]:
+                    existing.append(refname)
+        return existing
+    def __list_local_refs(self, refs):
+        existing = []
+        for refname in self.git('for-each-ref', '--format=%(refname)', *refs).split('\n'):
+            if len(refname):
+                existing.append(refname)
+        return existing
+    def __report(self, action, platform, shard, error):
+        sys.stderr.write('could not %s %s with shard %s: %s\n' % (action, platform, shard, error.stderr.decode('utf-8', 'replace').strip()))
+    def pull(self, platforms):
+        # fetch only the refs of platforms owned by other shards, the owner always wins
+        # an unreachable peer is reported and skipped, the shards it could not be fetched from are returned
+        failed = []
+        for platform in platforms:
+            if self.is_owner(platform):
+                continue
+            remote = self.shardmap.get_repo(platform)
+            refs = self.shardmap.get_refs(platform)
+            try:
+                remote_refs = self.__list_remote_refs(remote, refs)
+                stale_refs = set(self.__list_local_refs(refs)) - set(remote_refs)
+                if len(remote_refs):
+                    self.git.fetch(remote, *['+%s:%s' % (ref, ref) for ref in remote_refs])
+                for ref in stale_refs:
+                    self.git('update-ref', '-d', ref)
+            except sh.ErrorReturnCode as e:
+                self.__report('pull', platform, self.shardmap.get_owner(platform), e)
+                failed.append(self.shardmap.get_owner(platform))
+        return sorted(set(failed))
+    def push(self, platforms):
+        # hand the refs of owned platforms to all peers that cannot fetch from us
+        failed = []
+        for platform in platforms:
+            if not self.is_owner(platform):
+                continue
+            refs = self.shardmap.get_refs(platform)
+            local_refs = self.__list_local_refs(refs)
+            for (shard, remote) in sorted(self.shardmap.shards.items()):
+                if shard == self.shard:
+                    continue
+                try:
+                    # refs we deleted, like the bad refs of a finished bisection, go away on the peer too
+                    stale_refs = sorted(set(self.__list_remote_refs(remote, refs)) - set(local_refs))
+                    refspecs = ['+%s:%s' % (ref, ref) for ref in local_refs] + [':%s' % ref for ref in stale_refs]
+                    if len(refspecs):
+                        self.git.push(remote, *refspecs)
+                except sh.ErrorReturnCode as e:
+                    self.__report('push', platform, shard, e)
+                    failed.append(shard)
+        return sorted(set(failed))
+# vim: set et sw=4 ts=4:
@@ -0,0 +1,16 @@
+#!/bin/bash
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+echo "building commit $1 from repo $2 on platform $3 as builder $4 in workdir $5."
+if [ -n "$TB3_TEST_IGNORE_TERM" ]; then
+    trap '' TERM
+fi
+echo "error: fatal failure" >&2
+sleep 60
+true
+# vim: set et sw=4 ts=4:
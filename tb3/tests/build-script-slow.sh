@@ -0,0 +1,17 @@
+#!/bin/bash
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+echo "building commit $1 from repo $2 on platform $3 as builder $4 in workdir $5."
+if [ -n "$TB3_TEST_BUILD_STARTED" ]; then
+    touch "$TB3_TEST_BUILD_STARTED"
+fi
+if [ "$1" == "$TB3_TEST_SLOW_COMMIT" ]; then
+    sleep ${TB3_TEST_SLOW_SECONDS:-60}
+fi
+true
+# vim: set et sw=4 ts=4:
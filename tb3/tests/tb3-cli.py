@@ -7,6 +7,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
+import json
 import sh
 import sys
 import os
@@ -43,10 +44,60 @@ class TestTb3Cli(unittest.TestCase):
     def test_set_commit_running(self):
         self.tb3(set_commit_running=self.head)
         self.tb3(set_commit_running=self.head, estimated_duration=240)
+    def test_set_commit_preempted(self):
+        self.tb3(set_commit_running=self.head)
+        self.tb3(set_commit_preempted=self.head)
+    def test_compact_history(self):
+        self.tb3(compact_history=True)
+        self.tb3(set_commit_running=self.head)
+        self.tb3(set_commit_finished=self.head, result='good')
+        self.tb3(compact_history=True, archive_history=True)
+        with self.assertRaises(sh.ErrorReturnCode_1):
+            sh.tb3(repo=self.testdir, compact_history=True)
+    def test_shards(self):
+        shardmap = os.path.join(self.testdir, '.git', 'shards.json')
+        with open(shardmap, 'w') as f:
+            json.dump({'shards' : {'a' : self.testdir, 'b' : self.testdir}, 'platforms' : {'linux' : 'a', 'windows' : 'b'}}, f)
+        self.tb3(set_commit_running=self.head, shard_map=shardmap, shard='a')
+        with self.assertRaises(sh.ErrorReturnCode_2):
+            self.tb3(set_commit_running=self.head, shard_map=shardmap, shard='b')
+        self.tb3(replicate=True, publish=True, shard_map=shardmap, shard='a')
+        with self.assertRaises(sh.ErrorReturnCode_1):
+            self.tb3(replicate=True)
+        with self.assertRaises(sh.ErrorReturnCode_1):
+            self.tb3(publish=True)
+        with open(shardmap, 'w') as f:
+            json.dump({'shards' : {'a' : self.testdir, 'b' : os.path.join(self.testdir, 'missing')}, 'platforms' : {'linux' : 'a', 'windows' : 'b'}}, f)
+        # an unreachable shard fails the command only after the owned platform was updated
+        with self.assertRaises(sh.ErrorReturnCode_3):
+            self.tb3(replicate=True, set_commit_finished=self.head, result='good', shard_map=shardmap, shard='a')
+        self.assertEqual(tb3.repostate.RepoState('linux', 'master', self.testdir).get_last_good(), self.head)
+    def test_artifacts(self):
+        with self.assertRaises(sh.ErrorReturnCode_1):
+            self.tb3(show_artifact=self.head)
+        self.tb3(set_commit_finished=self.head, result='good', result_reference='foo.out.gz')
+        with self.assertRaises(sh.ErrorReturnCode_1):
+            self.tb3(show_artifact=self.head)
+        self.tb3(set_commit_finished=self.head, result='good', result_reference='foo', index_artifact=True)
+        self.assertEqual(str(self.tb3(show_artifact=self.head)), '%s foo\n' % self.head)
+        self.assertEqual(json.loads(str(self.tb3(show_artifact=self.head, format='json'))), {'commit' : self.head, 'reference' : 'foo'})
+        with self.assertRaises(sh.ErrorReturnCode_1):
+            self.tb3(show_artifact=self.head, artifact_state='bad')
+        self.tb3(import_artifacts=self.testdir)
     def test_show_state(self):
         self.tb3(show_state=True)
+        self.tb3(set_commit_finished=self.head, result='good')
+        summary = json.loads(str(self.tb3(show_state=True, format='json')))
+        self.assertEqual((summary['last_good'], summary['counts']), (self.head, {'GOOD' : 1}))
+        summary = json.loads(str(sh.Command('tb3-show-state')(repo=self.testdir, branch=self.branch, platform=self.platform, format='json')))
+        self.assertEqual(summary['unbuilt'], 0)
+        self.tb3(rebuild_summary=True)
     def test_show_history(self):
         self.tb3(show_history=True, history_count=5)
+    def test_show_metrics(self):
+        self.tb3(set_commit_running=self.head)
+        metrics = str(self.tb3(show_metrics=True))
+        self.assertIn('tb3_running_builds{branch="master",platform="linux"} 1.0', metrics)
     def test_show_proposals(self):
         self.tb3(show_proposals=True)
         self.tb3(show_proposals=True, format='json')
@@ -0,0 +1,15 @@
+#!/bin/bash
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# the coordinator becomes unreachable once the build started
+if [ -e "$TB3_TEST_BUILD_STARTED" ] && [[ " $* " == *" --sync "* ]]; then
+    echo "fatal: unable to access the origin" >&2
+    exit 128
+fi
+exec ./tb3 "$@"
+# vim: set et sw=4 ts=4:
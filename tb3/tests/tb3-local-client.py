@@ -7,6 +7,8 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
+import datetime
+import gzip
 import os
 import re
 import sh
@@ -33,6 +35,7 @@ class TestTb3LocalClient(unittest.TestCase):
             tb3_master='./tb3',
             script='./tests/build-script.sh',
             logdir=self.logdir,
+            metrics_textfile=os.path.join(self.testdir, 'tb3.prom'),
             count=1)
         self.state = tb3.repostate.RepoState(self.platform, self.branch, self.testdir)
         self.history = tb3.repostate.RepoHistory(self.platform, self.testdir)
@@ -52,13 +55,79 @@ class TestTb3LocalClient(unittest.TestCase):
         logfiles = logdirs[0][2]
         self.assertEqual(len(logfiles), 1) # only one file in dir
         self.assertEqual(state.artifactreference, logfiles[0])
-        logfile = open(os.path.join(self.logdir, logfiles[0]), 'r')
+        logfile = gzip.open(os.path.join(self.logdir, logfiles[0]), 'rt')
         lines = [line for line in logfile]
         self.assertEqual(len(lines), 1)
         self.assertNotEqual(re.search('building commit %s' % self.head, lines[0]), None)
         self.assertNotEqual(re.search('from repo %s' % self.testdir, lines[0]), None)
         self.assertNotEqual(re.search('on platform %s' % self.platform, lines[0]), None)
         self.assertNotEqual(re.search('as builder %s' % self.builder, lines[0]), None)
+        metrics = open(os.path.join(self.testdir, 'tb3.prom'), 'r').read()
+        self.assertIn('tb3_client_builds_total{branch="master",builder="testbuilder",platform="linux",repo="%s",result="good"} 1.0' % self.testdir, metrics)
+        self.assertIn('tb3_client_proposals_total{branch="master",builder="testbuilder",platform="linux",repo="%s"}' % self.testdir, metrics)
+        self.assertIn('tb3_client_idle_seconds_total{builder="testbuilder"}', metrics)
+    def test_fatal_pattern(self):
+        starttime = datetime.datetime.now()
+        self.tb3localclient(script='./tests/build-script-fatal.sh', fatal_pattern='^error:')
+        self.assertLess((datetime.datetime.now() - starttime).total_seconds(), 30)
+        self.assertEqual(self.state.get_first_bad(), self.head)
+        state = self.history.get_commit_state(self.head)
+        self.assertEqual(state.state, 'BAD')
+        logfile = gzip.open(os.path.join(self.logdir, state.artifactreference), 'rt')
+        self.assertIn('error: fatal failure\n', [line for line in logfile])
+    def test_kill_grace_period(self):
+        os.environ['TB3_TEST_IGNORE_TERM'] = '1'
+        starttime = datetime.datetime.now()
+        try:
+            self.tb3localclient(script='./tests/build-script-fatal.sh', fatal_pattern='^error:', kill_grace_period=1)
+        finally:
+            del os.environ['TB3_TEST_IGNORE_TERM']
+        self.assertLess((datetime.datetime.now() - starttime).total_seconds(), 30)
+        self.assertEqual(self.history.get_commit_state(self.head).state, 'BAD')
+    def __preempt(self, **kwargs):
+        branchstate = tb3.repostate.RepoState(self.platform, 'branch', self.testdir)
+        os.environ['TB3_TEST_SLOW_COMMIT'] = self.head
+        starttime = datetime.datetime.now()
+        self.tb3localclient('--proposal-source', self.testdir, 'branch', self.platform, 3, 1, script='./tests/build-script-slow.sh', preempt_factor=2, preempt_poll_interval=0, **kwargs)
+        self.assertLess((datetime.datetime.now() - starttime).total_seconds(), 30)
+        self.assertEqual(self.history.get_commit_state(self.head).state, 'UNKNOWN')
+        self.assertEqual(self.history.get_commit_state(branchstate.get_head()).state, 'GOOD')
+        self.assertEqual(branchstate.get_last_good(), branchstate.get_head())
+    def test_preemption(self):
+        self.__preempt()
+    def test_preemption_fair_share(self):
+        self.__preempt(fair_share_window=24)
+    def test_preempt_factor(self):
+        with self.assertRaises(sh.ErrorReturnCode_1):
+            self.tb3localclient(preempt_factor=0.5)
+        with self.assertRaises(sh.ErrorReturnCode_1):
+            self.tb3localclient(preempt_factor=1)
+    def test_preemption_poll_failure(self):
+        os.environ['TB3_TEST_SLOW_COMMIT'] = self.head
+        os.environ['TB3_TEST_SLOW_SECONDS'] = '5'
+        os.environ['TB3_TEST_BUILD_STARTED'] = os.path.join(self.logdir, 'started')
+        try:
+            self.tb3localclient(tb3_master='./tests/tb3-failing-sync.sh', script='./tests/build-script-slow.sh', preempt_factor=2, preempt_poll_interval=0)
+        finally:
+            for name in ['TB3_TEST_SLOW_SECONDS', 'TB3_TEST_BUILD_STARTED']:
+                del os.environ[name]
+        self.assertEqual(self.history.get_commit_state(self.head).state, 'GOOD')
+    def test_fair_share(self):
+        branchstate = tb3.repostate.RepoState(self.platform, 'branch', self.testdir)
+        self.tb3localclient('--proposal-source', self.testdir, 'branch', self.platform, 1, 1, '--freshness-sla', self.testdir, 'branch', self.platform, 0, '--target-share', self.testdir, self.branch, self.platform, 3, fair_share_window=24)
+        self.assertEqual(branchstate.get_last_good(), branchstate.get_head())
+        self.assertEqual(self.history.get_commit_state(self.head).state, 'UNKNOWN')
+        metrics = open(os.path.join(self.testdir, 'tb3.prom'), 'r').read()
+        self.assertIn('tb3_client_fair_share_weight{branch="master",builder="testbuilder",platform="linux",repo="%s"}' % self.testdir, metrics)
+    def test_fair_share_min_score(self):
+        branchstate = tb3.repostate.RepoState(self.platform, 'branch', self.testdir)
+        branchhead = branchstate.get_head()
+        updater = tb3.repostate.RepoStateUpdater(self.platform, 'branch', self.testdir)
+        updater.set_finished('%s^' % branchhead, 'otherbuilder', 'GOOD', 'foo')
+        updater.set_scheduled(branchhead, 'otherbuilder', datetime.timedelta(hours=1))
+        # the overdue branch has nothing worth building, so master is built
+        self.tb3localclient('--proposal-source', self.testdir, 'branch', self.platform, 1, 1, '--freshness-sla', self.testdir, 'branch', self.platform, 0, fair_share_window=24, poll_idle_time=1, _timeout=60)
+        self.assertEqual(self.state.get_last_good(), self.head)
 
 if __name__ == '__main__':
     unittest.main()
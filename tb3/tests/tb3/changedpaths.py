@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import datetime
+import json
+import os.path
+import sh
+import sys
+import tempfile
+import unittest
+
+sys.path.append('./dist-packages')
+sys.path.append('./tests')
+import helpers
+import tb3.changedpaths
+import tb3.metrics
+import tb3.repostate
+import tb3.scheduler
+
+
+class TestChangedPathIndex(unittest.TestCase):
+    def __resolve_ref(self, refname):
+        return self.git('show-ref', refname).split(' ')[0]
+    def setUp(self):
+        (self.testdir, self.git) = helpers.createTestRepo()
+        self.state = tb3.repostate.RepoState('linux', 'master', self.testdir)
+        self.head = self.state.get_head()
+        self.preb1 = self.__resolve_ref('refs/tags/pre-branchoff-1')
+    def tearDown(self):
+        sh.rm('-r', self.testdir)
+    def test_changed_paths(self):
+        index = tb3.changedpaths.ChangedPathIndex(self.testdir)
+        self.assertEqual(index.get_changed_paths(self.preb1), ['commit0'])
+        self.assertEqual(index.get_changed_paths(self.head), ['commit9'])
+    def test_index_range(self):
+        index = tb3.changedpaths.ChangedPathIndex(self.testdir)
+        index.index_range(self.preb1, self.head)
+        self.assertEqual(sum((len(shard) for shard in index.shards.values())), 9)
+        commits = self.git('rev-list', '%s..%s' % (self.preb1, self.head)).split()
+        self.assertEqual(sorted(os.listdir(index.cachedir)), sorted(set(('%s.json' % commit[:2] for commit in commits))))
+        # a fresh index is served from the cache and reads only the shard of the commit
+        index = tb3.changedpaths.ChangedPathIndex(self.testdir)
+        self.assertEqual(index.get_changed_paths(self.head), ['commit9'])
+        self.assertEqual(list(index.shards.keys()), [self.head[:2]])
+    def test_non_ascii(self):
+        sh.touch('\u00e4nderung', 'other', _cwd=self.testdir)
+        self.git.add('\u00e4nderung', 'other')
+        self.git.commit('-m', 'non ascii')
+        self.git.commit('--allow-empty', '-m', 'empty')
+        commits = self.git('rev-list', '-2', 'HEAD').split()
+        index = tb3.changedpaths.ChangedPathIndex(self.testdir)
+        index.index_commits(commits)
+        self.assertEqual(index.get_changed_paths(commits[0]), [])
+        self.assertEqual(index.get_changed_paths(commits[1]), ['other', '\u00e4nderung'])
+        pathfilter = tb3.changedpaths.PathFilter('linux', self.testdir, ['other', '\u00e4*'])
+        self.assertFalse(pathfilter.is_relevant(commits[1]))
+    def test_merge(self):
+        self.git.checkout('master')
+        self.git.merge('branch', '--no-edit', no_ff=True)
+        merge = self.state.get_head()
+        index = tb3.changedpaths.ChangedPathIndex(self.testdir)
+        self.assertEqual(sorted(index.get_changed_paths(merge)), ['branch%d' % n for n in range(1,10)])
+
+class TestPathFilter(unittest.TestCase):
+    def __resolve_ref(self, refname):
+        return self.git('show-ref', refname).split(' ')[0]
+    def setUp(self):
+        (self.testdir, self.git) = helpers.createTestRepo()
+        self.state = tb3.repostate.RepoState('linux', 'master', self.testdir)
+        self.history = tb3.repostate.RepoHistory('linux', self.testdir)
+        self.head = self.state.get_head()
+        self.preb1 = self.__resolve_ref('refs/tags/pre-branchoff-1')
+        self.postb1 = self.__resolve_ref('refs/tags/post-branchoff-1')
+        self.relevant = self.git('rev-parse', '%s~3' % self.postb1).strip()
+        self.pathfilter = tb3.changedpaths.PathFilter('linux', self.testdir, ['commit[1-35-68]'])
+    def tearDown(self):
+        sh.rm('-r', self.testdir)
+    def test_is_relevant(self):
+        self.assertTrue(self.pathfilter.is_relevant(self.head))
+        self.assertTrue(self.pathfilter.is_relevant(self.relevant))
+        self.assertFalse(self.pathfilter.is_relevant(self.git('rev-parse', '%s^' % self.postb1).strip()))
+    def test_rules_file(self):
+        (fd, rulesfile) = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'*' : ['commit1'], 'linux' : ['commit2'], 'windows' : ['commit3']}, f)
+        pathfilter = tb3.changedpaths.PathFilter.from_rules_file('linux', self.testdir, rulesfile)
+        os.remove(rulesfile)
+        self.assertEqual(pathfilter.irrelevant_patterns, ['commit1', 'commit2'])
+    def test_head_scheduler(self):
+        self.state.set_last_good(self.preb1)
+        scheduler = tb3.scheduler.HeadScheduler('linux', 'master', self.testdir, self.pathfilter)
+        proposals = scheduler.get_proposals(datetime.datetime.now())
+        self.assertEqual(set((p.commit for p in proposals)), set([self.head, self.postb1, self.relevant]))
+    def test_bisect_breaking(self):
+        updater = tb3.repostate.RepoStateUpdater('linux', 'master', self.testdir, self.pathfilter)
+        updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        updater.set_finished(self.relevant, 'testbuilder', 'GOOD', 'foo')
+        # an earlier result of an irrelevant commit is kept when assuming its state
+        self.history.set_commit_state('%s^' % self.postb1, tb3.repostate.CommitState(results=[['BAD', 'otherbuilder', 0.0]]))
+        updater.set_finished(self.postb1, 'testbuilder', 'BAD', 'foo')
+        self.assertEqual(self.history.get_commit_state(self.postb1).state, 'BREAKING')
+        self.assertEqual(self.history.get_commit_state('%s^' % self.postb1).state, 'ASSUMED_GOOD')
+        self.assertEqual([r[0] for r in self.history.get_commit_state('%s^' % self.postb1).results], ['BAD'])
+        scheduler = tb3.scheduler.BisectScheduler('linux', 'master', self.testdir, self.pathfilter)
+        self.assertEqual(scheduler.get_proposals(datetime.datetime.now()), [])
+    def test_irrelevant_on_top(self):
+        pathfilter = tb3.changedpaths.PathFilter('linux', self.testdir, ['commit[89]'])
+        updater = tb3.repostate.RepoStateUpdater('linux', 'master', self.testdir, pathfilter)
+        updater.set_finished(self.postb1, 'testbuilder', 'GOOD', 'foo')
+        self.assertEqual(self.history.get_commit_state(self.head).state, 'ASSUMED_GOOD')
+        self.assertEqual(self.history.get_commit_state('%s^' % self.head).state, 'ASSUMED_GOOD')
+        self.assertEqual(self.state.get_unbuilt(pathfilter), [])
+        self.assertEqual(len(self.state.get_unbuilt()), 2)
+        self.assertEqual(updater.get_summary()['unbuilt'], 0)
+        metrics = str(tb3.metrics.CoordinatorMetrics('linux', 'master', self.testdir, pathfilter=pathfilter).get_metrics(datetime.datetime.now()))
+        self.assertIn('tb3_unbuilt_commits{branch="master",platform="linux"} 0.0', metrics)
+        updater.set_finished(self.head, 'testbuilder', 'BAD', 'foo')
+        # the only commit in between cannot have broken it
+        self.assertEqual(self.history.get_commit_state(self.head).state, 'BREAKING')
+        self.assertEqual(self.history.get_commit_state('%s^' % self.head).state, 'ASSUMED_GOOD')
+
+if __name__ == '__main__':
+    unittest.main()
+# vim: set et sw=4 ts=4:
@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import datetime
+import sys
+import unittest
+
+sys.path.append('./dist-packages')
+import tb3.fairshare
+
+
+class TestFairShare(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2014, 1, 1, 12, 0, 0)
+        (self.master, self.release) = (('core', 'master', 'linux'), ('core', 'release', 'linux'))
+        self.fairshare = tb3.fairshare.FairShare([self.master, self.release], datetime.timedelta(hours=24), self.now - datetime.timedelta(hours=48))
+    def __build(self, scenario, hours_ago, hours):
+        started = self.now - datetime.timedelta(hours=hours_ago)
+        self.fairshare.record(scenario, started, started + datetime.timedelta(hours=hours))
+    def test_usage(self):
+        self.__build(self.master, 30, 2)
+        self.__build(self.master, 25, 2)
+        self.__build(self.release, 5, 1)
+        # the first build expired, the second one only counts inside the window
+        self.assertEqual(self.fairshare.get_usage(self.now), {self.master : 3600.0, self.release : 3600.0})
+        self.assertEqual(len(self.fairshare.usage), 2)
+    def test_weight(self):
+        self.assertEqual(self.fairshare.get_weight(self.master, self.now), 1.0)
+        self.__build(self.master, 10, 3)
+        self.__build(self.release, 5, 1)
+        self.assertLess(self.fairshare.get_weight(self.master, self.now), 1.0)
+        self.assertGreater(self.fairshare.get_weight(self.release, self.now), 1.0)
+        self.assertGreater(self.fairshare.get_priority(self.release, 10, self.now), self.fairshare.get_priority(self.master, 15, self.now))
+    def test_target_share(self):
+        self.fairshare.shares = {self.master : 3.0}
+        self.assertEqual(self.fairshare.get_target_share(self.master), 0.75)
+        self.__build(self.master, 10, 3)
+        self.__build(self.release, 5, 1)
+        self.assertEqual(self.fairshare.get_weight(self.master, self.now), 1.0)
+        self.assertEqual(self.fairshare.get_weight(self.release, self.now), 1.0)
+    def test_max_weight(self):
+        self.__build(self.master, 10, 8)
+        self.assertEqual(self.fairshare.get_weight(self.master, self.now), (0.5 + 0.1) / 1.1)
+        self.fairshare.max_weight = 2.0
+        self.assertEqual(self.fairshare.get_weight(self.release, self.now), 2.0)
+    def test_freshness_sla(self):
+        self.fairshare.slas = {self.release : datetime.timedelta(hours=12)}
+        self.__build(self.release, 6, 1)
+        self.__build(self.master, 30, 1)
+        self.assertEqual(self.fairshare.get_overdue(self.release, self.now), 0.0)
+        self.assertEqual(self.fairshare.get_overdue(self.master, self.now), 0.0)
+        self.assertEqual(self.fairshare.get_overdue(self.release, self.now + datetime.timedelta(hours=19)), 2.0)
+        # an overdue scenario wins regardless of scores
+        later = self.now + datetime.timedelta(hours=19)
+        self.assertGreater(self.fairshare.get_priority(self.release, 1, later), self.fairshare.get_priority(self.master, 100, later))
+        self.fairshare.serve(self.release, later)
+        self.assertEqual(self.fairshare.get_overdue(self.release, later), 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
+# vim: set et sw=4 ts=4:
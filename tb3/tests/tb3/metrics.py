@@ -0,0 +1,90 @@
+#! /usr/bin/env python3
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import datetime
+import os
+import sh
+import sys
+import tempfile
+import unittest
+
+sys.path.append('./dist-packages')
+sys.path.append('./tests')
+import helpers
+import tb3.metrics
+import tb3.repostate
+
+
+class TestMetrics(unittest.TestCase):
+    def test_format(self):
+        metrics = tb3.metrics.Metrics()
+        metrics.add('tb3_foo', 1, {'platform' : 'linux', 'branch' : 'master'}, 'Foo.')
+        metrics.add('tb3_foo', 2.5, {'platform' : 'win"dows', 'branch' : 'master'}, 'Foo.')
+        metrics.add('tb3_bar_total', 3, help='Bar.', metrictype='counter')
+        self.assertEqual(str(metrics),
+            '# HELP tb3_foo Foo.\n'
+            '# TYPE tb3_foo gauge\n'
+            'tb3_foo{branch="master",platform="linux"} 1.0\n'
+            'tb3_foo{branch="master",platform="win\\"dows"} 2.5\n'
+            '# HELP tb3_bar_total Bar.\n'
+            '# TYPE tb3_bar_total counter\n'
+            'tb3_bar_total 3.0\n')
+    def test_textfile(self):
+        metrics = tb3.metrics.Metrics()
+        metrics.add('tb3_foo', 1)
+        textdir = tempfile.mkdtemp()
+        textfile = os.path.join(textdir, 'tb3.prom')
+        metrics.write_textfile(textfile)
+        self.assertEqual(os.listdir(textdir), ['tb3.prom'])
+        self.assertEqual(open(textfile, 'r').read(), str(metrics))
+        sh.rm('-r', textdir)
+
+class TestCoordinatorMetrics(unittest.TestCase):
+    def __resolve_ref(self, refname):
+        return self.git('show-ref', refname).split(' ')[0]
+    def __get_samples(self, time=None):
+        metrics = tb3.metrics.CoordinatorMetrics('linux', 'master', self.testdir).get_metrics(time or datetime.datetime.now())
+        return dict(line.split('{')[0:1] + [float(line.split(' ')[-1])] for line in str(metrics).split('\n') if len(line) and not line.startswith('#'))
+    def setUp(self):
+        (self.testdir, self.git) = helpers.createTestRepo()
+        self.state = tb3.repostate.RepoState('linux', 'master', self.testdir)
+        self.updater = tb3.repostate.RepoStateUpdater('linux', 'master', self.testdir)
+        self.head = self.state.get_head()
+        self.preb1 = self.__resolve_ref('refs/tags/pre-branchoff-1')
+        self.postb1 = self.__resolve_ref('refs/tags/post-branchoff-1')
+    def tearDown(self):
+        sh.rm('-r', self.testdir)
+    def test_empty(self):
+        samples = self.__get_samples()
+        self.assertEqual(samples['tb3_unbuilt_commits'], 1)
+        self.assertEqual(samples['tb3_running_builds'], 0)
+        self.assertEqual(samples['tb3_active_builders'], 0)
+        self.assertEqual(samples['tb3_bisect_range_commits'], 0)
+    def test_oldest_unbuilt_age(self):
+        committed = datetime.datetime.utcfromtimestamp(int(self.git('log', '-1', '--format=%ct', self.head).strip()))
+        samples = self.__get_samples(committed + datetime.timedelta(hours=1))
+        self.assertEqual(samples['tb3_oldest_unbuilt_commit_age_seconds'], 3600)
+    def test_running(self):
+        self.updater.set_finished(self.preb1, 'box1', 'GOOD', 'foo')
+        self.updater.set_scheduled(self.postb1, 'box2', datetime.timedelta(hours=1))
+        self.updater.set_scheduled(self.head, 'box3', datetime.timedelta(hours=1))
+        samples = self.__get_samples()
+        self.assertEqual(samples['tb3_unbuilt_commits'], 9)
+        self.assertGreaterEqual(samples['tb3_oldest_unbuilt_commit_age_seconds'], 0)
+        self.assertEqual(samples['tb3_running_builds'], 2)
+        self.assertEqual(samples['tb3_active_builders'], 3)
+        self.updater.set_finished(self.postb1, 'box2', 'BAD', 'foo')
+        samples = self.__get_samples()
+        self.assertEqual(samples['tb3_running_builds'], 1)
+        self.assertEqual(samples['tb3_bisect_range_commits'], 6)
+        self.assertEqual(samples['tb3_unbuilt_commits'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
+# vim: set et sw=4 ts=4:
@@ -65,6 +65,17 @@ class TestRepoHistory(unittest.TestCase):
             self.assertEqual(self.history.get_commit_state(self.head), commitstate)
         with self.assertRaises(AttributeError):
             self.history.set_commit_state(self.head, tb3.repostate.CommitState('foo!'))
+    def test_confidence(self):
+        self.assertEqual(tb3.repostate.CommitState('BAD').get_confidence(0.1), 1.0)
+        commitstate = tb3.repostate.CommitState('BAD', results=[['BAD', 'box', 0]])
+        self.assertAlmostEqual(commitstate.get_confidence(0.1), 0.9)
+        commitstate.results.append(['BAD', 'box', 1])
+        self.assertAlmostEqual(commitstate.get_confidence(0.1), 0.99)
+        commitstate.results.append(['GOOD', 'box', 2])
+        self.assertAlmostEqual(commitstate.get_confidence(0.1), 0.66)
+        commitstate.state = 'RUNNING'
+        self.assertEqual(commitstate.get_confidence(0.1), 1.0)
+        self.assertAlmostEqual(commitstate.get_confidence(0.1, 'GOOD'), 0.3)
     def test_duration(self):
         commitstate = tb3.repostate.CommitState(estimated_duration=datetime.timedelta(hours=3, minutes=14))
         self.history.set_commit_state(self.head, commitstate)
@@ -78,6 +89,195 @@ class TestRepoHistory(unittest.TestCase):
         self.assertLess(abs((commitstate.started - now).total_seconds()), 0.01)
         self.assertLess(abs((commitstate.finished -now).total_seconds()), 0.01)
 
+class TestRepoHistoryCompaction(unittest.TestCase):
+    def setUp(self):
+        (self.testdir, self.git) = helpers.createTestRepo()
+        self.state = tb3.repostate.RepoState('linux', 'master', self.testdir)
+        self.head = self.state.get_head()
+        self.history = tb3.repostate.RepoHistory('linux', self.testdir)
+    def tearDown(self):
+        sh.rm('-r', self.testdir)
+    def __count_history(self):
+        return int(self.git('rev-list', '--count', self.history.notesref))
+    def test_compact(self):
+        self.assertEqual(self.history.compact(), None)
+        for state in ['RUNNING', 'GOOD']:
+            self.history.set_commit_state(self.head, tb3.repostate.CommitState(state))
+            self.history.set_commit_state('%s^' % self.head, tb3.repostate.CommitState(state))
+        self.assertEqual(self.__count_history(), 4)
+        self.history.compact()
+        self.assertEqual(self.__count_history(), 1)
+        self.assertEqual(self.history.get_commit_state(self.head).state, 'GOOD')
+        self.assertEqual(self.history.get_commit_state('%s^' % self.head).state, 'GOOD')
+        self.assertEqual(self.git('for-each-ref', 'refs/tb3/archive').strip(), '')
+        self.history.set_commit_state(self.head, tb3.repostate.CommitState('BAD'))
+        self.assertEqual(self.__count_history(), 2)
+    def test_prune(self):
+        self.history.set_commit_state(self.head, tb3.repostate.CommitState('RUNNING'))
+        self.history.set_commit_state(self.head, tb3.repostate.CommitState('GOOD'))
+        oldtip = self.git('rev-parse', self.history.notesref).strip()
+        self.assertIn(oldtip, self.git('rev-list', '--reflog').split())
+        self.history.compact()
+        self.git.gc('--prune=now', '-q')
+        self.assertNotIn(oldtip, self.git('rev-list', '--reflog').split())
+        self.assertNotEqual(self.git('cat-file', '-e', oldtip, _ok_code=[0,1,128]).exit_code, 0)
+    def test_archive(self):
+        self.history.set_commit_state(self.head, tb3.repostate.CommitState('RUNNING'))
+        self.history.set_commit_state(self.head, tb3.repostate.CommitState('GOOD'))
+        oldtip = self.git('rev-parse', self.history.notesref).strip()
+        self.history.compact(archive=True)
+        self.assertEqual(self.__count_history(), 1)
+        self.assertEqual(self.git('rev-parse', 'refs/tb3/archive/history/linux/%s' % oldtip).strip(), oldtip)
+
+class TestRepoStats(unittest.TestCase):
+    def setUp(self):
+        (self.testdir, self.git) = helpers.createTestRepo()
+        self.state = tb3.repostate.RepoState('linux', 'master', self.testdir)
+        self.head = self.state.get_head()
+        self.stats = tb3.repostate.RepoStats('linux', 'master', self.testdir)
+    def tearDown(self):
+        sh.rm('-r', self.testdir)
+    def test_update(self):
+        self.assertEqual(self.stats.get(), {})
+        self.stats.update(lambda stats: stats.update({'foo' : 1}))
+        self.stats.update(lambda stats: stats.update({'bar' : 2}))
+        self.assertEqual(self.stats.get(), {'foo' : 1, 'bar' : 2})
+    def test_running(self):
+        now = datetime.datetime.now()
+        self.stats.set_running(self.head, 'testbuilder', now, datetime.timedelta(hours=1))
+        self.assertEqual(list(self.stats.get_running(now).keys()), [self.head])
+        self.assertEqual(self.stats.get_running(now+datetime.timedelta(hours=3)), {})
+        self.stats.set_done(self.head, 'testbuilder', now)
+        self.assertEqual(self.stats.get_running(now), {})
+        self.assertEqual(list(self.stats.get()['builders'].keys()), ['testbuilder'])
+
+class TestArtifactIndex(unittest.TestCase):
+    def __resolve_ref(self, refname):
+        return self.git('show-ref', refname).split(' ')[0]
+    def setUp(self):
+        (self.testdir, self.git) = helpers.createTestRepo()
+        self.preb1 = self.__resolve_ref('refs/tags/pre-branchoff-1')
+        self.preb2 = self.__resolve_ref('refs/tags/pre-branchoff-2')
+        self.bp = self.__resolve_ref('refs/tags/branchpoint')
+        self.postb1 = self.__resolve_ref('refs/tags/post-branchoff-1')
+        self.postb2 = self.__resolve_ref('refs/tags/post-branchoff-2')
+        self.branchhead = self.__resolve_ref('refs/tags/post-branchoff-on-branch-2')
+        self.index = tb3.repostate.ArtifactIndex('linux', self.testdir)
+    def tearDown(self):
+        sh.rm('-r', self.testdir)
+    def test_nearest(self):
+        self.index.add(self.postb1, 'GOOD', 'postb1')
+        self.index.add(self.preb2, 'GOOD', 'preb2')
+        self.index.add(self.postb2, 'BAD', 'postb2')
+        self.assertEqual(self.index.get_nearest(self.postb2, 'GOOD'), (self.postb1, 'postb1'))
+        self.assertEqual(self.index.get_nearest(self.postb1, 'GOOD'), (self.postb1, 'postb1'))
+        self.assertEqual(self.index.get_nearest(self.bp, 'GOOD'), (self.preb2, 'preb2'))
+        self.assertEqual(self.index.get_nearest(self.preb1, 'GOOD'), None)
+        self.assertEqual(self.index.get_nearest(self.postb2, 'BAD'), (self.postb2, 'postb2'))
+        self.assertEqual(self.index.get_nearest(self.postb1, 'BAD'), None)
+        # postb1 is not on the first parent chain of the branch
+        self.assertEqual(self.index.get_nearest(self.branchhead, 'GOOD'), (self.preb2, 'preb2'))
+        # all artifacts of a platform are in one ref
+        self.assertEqual(self.git('for-each-ref', '--format=%(refname)', 'refs/tb3/artifacts/').split(), ['refs/tb3/artifacts/linux'])
+    def test_distant(self):
+        (testdir, git) = helpers.createTestRepo(20)
+        index = tb3.repostate.ArtifactIndex('linux', testdir)
+        preb1 = git('rev-parse', 'pre-branchoff-1').strip()
+        index.MAX_WALK = 4
+        index.add(preb1, 'GOOD', 'preb1')
+        # further away than the walk to the nearest indexed commit goes
+        self.assertEqual(index.get_nearest('master', 'GOOD'), (preb1, 'preb1'))
+        self.assertEqual(index.get()['GOOD'][0][0], int(git('rev-list', '--count', '--first-parent', preb1).strip()))
+        sh.rm('-r', testdir)
+    def test_replace(self):
+        self.index.add(self.preb2, 'GOOD', 'foo')
+        self.index.add(self.preb2, 'GOOD', 'bar')
+        self.assertEqual(self.index.get_nearest(self.postb2, 'GOOD'), (self.preb2, 'bar'))
+    def test_import_tags(self):
+        (binrepo, bingit) = helpers.createTestRepo()
+        bingit.tag('source-hash-%s' % self.preb2)
+        bingit.tag('source-hash-%s' % ('0'*40))
+        self.assertEqual(self.index.import_tags(binrepo), 1)
+        sh.rm('-r', binrepo)
+        self.assertEqual(self.index.get_nearest(self.postb2, 'GOOD'), (self.preb2, 'source-hash-%s' % self.preb2))
+    def test_updater(self):
+        updater = tb3.repostate.RepoStateUpdater('linux', 'master', self.testdir)
+        updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo', True)
+        updater.set_finished(self.preb2, 'testbuilder', 'GOOD', 'bar')
+        updater.set_finished(self.bp, 'testbuilder', 'GOOD', 'null', True)
+        updater.set_finished(self.postb1, 'testbuilder', 'GOOD', '', True)
+        self.assertEqual(self.index.get_nearest(self.postb1, 'GOOD'), (self.preb1, 'foo'))
+
+class TestRepoSummary(unittest.TestCase):
+    def __resolve_ref(self, refname):
+        return self.git('show-ref', refname).split(' ')[0]
+    def setUp(self):
+        (self.testdir, self.git) = helpers.createTestRepo()
+        self.preb1 = self.__resolve_ref('refs/tags/pre-branchoff-1')
+        self.postb1 = self.__resolve_ref('refs/tags/post-branchoff-1')
+        self.head = tb3.repostate.RepoState('linux', 'master', self.testdir).get_head()
+        self.updater = tb3.repostate.RepoStateUpdater('linux', 'master', self.testdir)
+        self.summary = tb3.repostate.RepoSummary('linux', 'master', self.testdir)
+    def tearDown(self):
+        sh.rm('-r', self.testdir)
+    def test_transitions(self):
+        self.updater.set_scheduled(self.preb1, 'testbuilder', datetime.timedelta(hours=1))
+        summary = self.updater.get_summary()
+        self.assertEqual(summary['counts'], {'RUNNING' : 1})
+        self.assertEqual((summary['unbuilt'], summary['oldest_unbuilt']), (1, self.head))
+        self.updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        summary = self.updater.get_summary()
+        self.assertEqual(summary['counts'], {'RUNNING' : 0, 'GOOD' : 1})
+        self.assertEqual(summary['last_good'], self.preb1)
+        self.assertEqual(summary['unbuilt'], 9)
+        self.assertEqual(summary['oldest_unbuilt'], self.git('rev-parse', '%s^^^^^^^^' % self.head).strip())
+        self.updater.set_finished(self.postb1, 'testbuilder', 'BAD', 'foo')
+        summary = self.updater.get_summary()
+        self.assertEqual(summary['counts'], {'RUNNING' : 0, 'GOOD' : 1, 'BAD' : 1, 'POSSIBLY_BREAKING' : 6})
+        self.assertEqual((summary['first_bad'], summary['breaking']), (self.postb1, None))
+        self.assertEqual(summary['unbuilt'], 2)
+        self.assertEqual(sorted(summary['last_transitions'].keys()), ['BAD', 'GOOD', 'POSSIBLY_BREAKING', 'RUNNING'])
+        self.updater.set_finished('%s^' % self.postb1, 'testbuilder', 'GOOD', 'foo')
+        summary = self.summary.get()
+        self.assertEqual(summary['counts'], {'RUNNING' : 0, 'GOOD' : 2, 'BAD' : 0, 'BREAKING' : 1, 'ASSUMED_GOOD' : 5, 'POSSIBLY_BREAKING' : 0})
+        self.assertEqual(summary['breaking'], self.postb1)
+    def test_head_moves(self):
+        self.updater.set_finished(self.head, 'testbuilder', 'GOOD', 'foo')
+        self.assertEqual(self.updater.get_summary()['unbuilt'], 0)
+        self.git.checkout('master')
+        self.git.commit('--allow-empty', '-m', 'new head')
+        # no transition happened, still the summary knows about the new commit
+        newhead = self.git('rev-parse', 'master').strip()
+        summary = self.updater.get_summary()
+        self.assertEqual((summary['head'], summary['unbuilt'], summary['oldest_unbuilt']), (newhead, 1, newhead))
+        self.assertFalse('head' in self.summary.get())
+    def test_preempted(self):
+        self.updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        self.updater.set_finished(self.postb1, 'testbuilder', 'BAD', 'foo')
+        counts = self.summary.get()['counts']
+        bp = self.git('rev-parse', 'branchpoint').strip()
+        self.updater.set_scheduled(bp, 'testbuilder', datetime.timedelta(hours=1))
+        self.updater.set_preempted(bp, 'testbuilder')
+        self.assertEqual(tb3.repostate.RepoHistory('linux', self.testdir).get_commit_state(bp).state, 'POSSIBLY_BREAKING')
+        self.assertEqual(dict(((state, count) for (state, count) in self.summary.get()['counts'].items() if count)), dict(((state, count) for (state, count) in counts.items() if count)))
+    def test_other_branch(self):
+        self.updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        branchupdater = tb3.repostate.RepoStateUpdater('linux', 'branch', self.testdir)
+        branchupdater.set_scheduled(self.preb1, 'testbuilder', datetime.timedelta(hours=1))
+        branchupdater.set_scheduled(self.git('rev-parse', 'branch').strip(), 'testbuilder', datetime.timedelta(hours=1))
+        # the commit only on the release branch does not count on master
+        self.assertEqual(self.summary.get()['counts'], {'GOOD' : 0, 'RUNNING' : 1})
+        self.assertEqual(tb3.repostate.RepoSummary('linux', 'branch', self.testdir).get()['counts'], {'GOOD' : 0, 'RUNNING' : 2})
+        self.updater.rebuild_summary()
+        self.assertEqual(self.summary.get()['counts'], {'RUNNING' : 1})
+    def test_rebuild(self):
+        self.updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        self.updater.set_finished(self.postb1, 'testbuilder', 'BAD', 'foo')
+        expected = self.summary.get()['counts']
+        self.git('update-ref', '-d', self.summary.refname)
+        self.updater.rebuild_summary()
+        self.assertEqual(dict(((state, count) for (state, count) in expected.items() if count)), self.summary.get()['counts'])
+
 class TestRepoUpdater(unittest.TestCase):
     def __resolve_ref(self, refname):
         return self.git('show-ref', refname).split(' ')[0]
@@ -95,6 +295,41 @@ class TestRepoUpdater(unittest.TestCase):
     def test_set_scheduled(self):
         self.updater.set_scheduled(self.head, 'testbuilder', datetime.timedelta(minutes=240))
         self.updater.set_scheduled(self.head, 'testbuilder', datetime.timedelta(minutes=2400))
+    def test_set_preempted(self):
+        self.updater.set_scheduled(self.head, 'testbuilder', datetime.timedelta(minutes=240))
+        self.updater.set_preempted(self.head, 'otherbuilder')
+        self.assertEqual(self.history.get_commit_state(self.head).state, 'RUNNING')
+        self.updater.set_preempted(self.head, 'testbuilder')
+        self.assertEqual(self.history.get_commit_state(self.head), tb3.repostate.CommitState())
+    def test_results(self):
+        self.updater.set_scheduled(self.head, 'testbuilder', datetime.timedelta(minutes=240))
+        self.updater.set_finished(self.head, 'testbuilder', 'GOOD', 'foo')
+        self.updater.set_scheduled(self.head, 'otherbuilder', datetime.timedelta(minutes=240))
+        self.assertEqual(len(self.history.get_commit_state(self.head).results), 1)
+        self.updater.set_finished(self.head, 'otherbuilder', 'GOOD', 'foo')
+        self.assertEqual([r[:2] for r in self.history.get_commit_state(self.head).results], [['GOOD', 'testbuilder'], ['GOOD', 'otherbuilder']])
+        self.assertAlmostEqual(self.updater.repostats.get_flakiness(), 1.0/11)
+    def test_refuted_failure(self):
+        self.updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        self.updater.set_finished(self.head, 'testbuilder', 'BAD', 'foo')
+        self.assertEqual(self.state.get_first_bad(), self.head)
+        self.assertEqual(self.history.get_commit_state('%s^' % self.head).state, 'POSSIBLY_BREAKING')
+        self.updater.set_scheduled(self.head, 'testbuilder', datetime.timedelta(minutes=240))
+        self.updater.set_finished(self.head, 'testbuilder', 'GOOD', 'foo')
+        self.assertEqual(self.state.get_first_bad(), None)
+        self.assertEqual(self.state.get_last_bad(), None)
+        self.assertEqual(self.state.get_last_good(), self.head)
+        self.assertEqual(self.history.get_commit_state(self.head).state, 'GOOD')
+        self.assertEqual(self.history.get_commit_state('%s^' % self.head).state, 'ASSUMED_GOOD')
+        self.assertAlmostEqual(self.updater.repostats.get_flakiness(), 2.0/11)
+    def test_keep_failure(self):
+        self.updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        self.updater.set_finished(self.bp, 'testbuilder', 'BAD', 'foo')
+        self.updater.set_finished(self.head, 'testbuilder', 'BAD', 'foo')
+        self.updater.set_scheduled(self.bp, 'testbuilder', datetime.timedelta(minutes=240))
+        self.updater.set_finished(self.bp, 'testbuilder', 'GOOD', 'foo')
+        self.assertEqual(self.history.get_commit_state(self.bp).state, 'BAD')
+        self.assertEqual(self.state.get_first_bad(), self.bp)
     def test_good_head(self):
         self.updater.set_finished(self.head, 'testbuilder', 'GOOD', 'foo')
     def test_bad_head(self):
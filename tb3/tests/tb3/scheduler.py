@@ -198,6 +198,59 @@ class TestBisectRuns(TestScheduler):
         self.assertIn(real_state, ['BAD'])
         self.assertIn(stored_state, ['BREAKING'])
 
+class TestConfirmScheduler(TestScheduler):
+    def test_get_proposals(self):
+        self.scheduler = tb3.scheduler.ConfirmScheduler('linux', 'master', self.testdir)
+        self.bisect_scheduler = tb3.scheduler.BisectScheduler('linux', 'master', self.testdir)
+        self.merge_scheduler = tb3.scheduler.MergeScheduler('linux', 'master', self.testdir)
+        self.merge_scheduler.add_scheduler(self.bisect_scheduler)
+        self.merge_scheduler.add_scheduler(self.scheduler)
+        now = datetime.datetime.now()
+        self.assertEqual(self.scheduler.get_proposals(now), [])
+        self.updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        self.updater.set_finished(self.head, 'testbuilder', 'BAD', 'foo')
+        best_proposal = self._get_best_proposal(self.merge_scheduler, now, 'commit 9', 9, False)
+        self.assertEqual(best_proposal.scheduler, 'ConfirmScheduler')
+        self.assertEqual(best_proposal.commit, self.head)
+        self.updater.set_scheduled(self.head, 'box', datetime.timedelta(hours=1))
+        self.assertEqual(self.scheduler.get_proposals(now), [])
+        self.updater.set_finished(self.head, 'box', 'BAD', 'foo')
+        self.assertEqual(self.scheduler.get_proposals(now), [])
+        best_proposal = self._get_best_proposal(self.merge_scheduler, now, 'commit [45]', 8, False)
+        self.assertEqual(best_proposal.scheduler, 'BisectScheduler')
+    def test_bisection_started(self):
+        self.scheduler = tb3.scheduler.ConfirmScheduler('linux', 'master', self.testdir)
+        self.bisect_scheduler = tb3.scheduler.BisectScheduler('linux', 'master', self.testdir)
+        now = datetime.datetime.now()
+        self.updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        self.updater.set_finished(self.head, 'testbuilder', 'BAD', 'foo')
+        self.assertEqual(len(self.scheduler.get_proposals(now)), 1)
+        # a bad bisection step is no new failure to confirm
+        self.updater.set_finished(self.bp, 'testbuilder', 'BAD', 'foo')
+        self.assertEqual(self.scheduler.get_proposals(now), [])
+        self.assertEqual(max([p.score for p in self.bisect_scheduler.get_proposals(now)]), 4.0)
+    def test_good_bisection_step(self):
+        self.scheduler = tb3.scheduler.ConfirmScheduler('linux', 'master', self.testdir)
+        now = datetime.datetime.now()
+        self.updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        self.updater.set_finished(self.head, 'testbuilder', 'BAD', 'foo')
+        self.updater.set_finished(self.bp, 'testbuilder', 'GOOD', 'foo')
+        self.assertEqual(self.scheduler.get_proposals(now), [])
+    def test_mixed_results(self):
+        self.scheduler = tb3.scheduler.ConfirmScheduler('linux', 'master', self.testdir)
+        self.bisect_scheduler = tb3.scheduler.BisectScheduler('linux', 'master', self.testdir)
+        now = datetime.datetime.now()
+        self.updater.set_finished(self.preb1, 'testbuilder', 'GOOD', 'foo')
+        self.updater.set_finished(self.bp, 'testbuilder', 'BAD', 'foo')
+        self.updater.set_finished(self.head, 'testbuilder', 'BAD', 'foo')
+        self.assertEqual([p.commit for p in self.scheduler.get_proposals(now)], [self.bp])
+        for state in ['GOOD', 'BAD', 'BAD', 'BAD', 'GOOD', 'BAD']:
+            self.updater.set_finished(self.bp, 'testbuilder', state, 'foo')
+            # the disputed failure was rebuilt once, now it is bisected again at full score
+            self.assertEqual(self.scheduler.get_proposals(now), [])
+            self.assertEqual(self.state.get_first_bad(), self.bp)
+            self.assertEqual(max([p.score for p in self.bisect_scheduler.get_proposals(now)]), 4.0)
+
 class TestMergeScheduler(TestScheduler):
     def test_get_proposal(self):
         self.state.set_last_good(self.preb1)
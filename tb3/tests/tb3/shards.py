@@ -0,0 +1,101 @@
+#! /usr/bin/env python3
+#
+# This file is part of the LibreOffice project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import json
+import os.path
+import sh
+import sys
+import tempfile
+import unittest
+
+sys.path.append('./dist-packages')
+sys.path.append('./tests')
+import helpers
+import tb3.repostate
+import tb3.shards
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        (self.testdir, self.git) = helpers.createTestRepo()
+        self.shardsdir = tempfile.mkdtemp()
+        self.repos = {}
+        for shard in ['a', 'b']:
+            self.repos[shard] = os.path.join(self.shardsdir, shard)
+            self.git.clone('--bare', self.testdir, self.repos[shard])
+        self.shardmap = tb3.shards.ShardMap(self.repos, {'linux' : 'a', 'windows' : 'b', '*' : 'a'})
+        self.head = tb3.repostate.RepoState('linux', 'master', self.testdir).get_head()
+    def tearDown(self):
+        sh.rm('-r', self.testdir)
+        sh.rm('-r', self.shardsdir)
+    def __finish(self, shard, platform, state):
+        tb3.repostate.RepoStateUpdater(platform, 'master', self.repos[shard]).set_finished(self.head, 'testbuilder', state, 'foo')
+    def __get_commit_state(self, shard, platform):
+        return tb3.repostate.RepoHistory(platform, self.repos[shard]).get_commit_state(self.head).state
+    def test_shardmap(self):
+        self.assertEqual(self.shardmap.get_owner('linux'), 'a')
+        self.assertEqual(self.shardmap.get_owner('windows'), 'b')
+        self.assertEqual(self.shardmap.get_owner('macosx'), 'a')
+        self.assertEqual(self.shardmap.get_repo('windows'), self.repos['b'])
+        self.assertEqual(self.shardmap.get_platforms(), ['linux', 'windows'])
+    def test_shardmap_file(self):
+        mapfile = os.path.join(self.shardsdir, 'shards.json')
+        with open(mapfile, 'w') as f:
+            json.dump({'shards' : self.repos, 'platforms' : {'linux' : 'b', '*' : 'a'}}, f)
+        shardmap = tb3.shards.ShardMap.from_file(mapfile)
+        self.assertEqual(shardmap.get_repo('linux'), self.repos['b'])
+        self.assertEqual(shardmap.get_repo('windows'), self.repos['a'])
+    def test_pull(self):
+        self.__finish('a', 'linux', 'GOOD')
+        self.__finish('b', 'windows', 'BAD')
+        self.__finish('b', 'linux', 'BAD')
+        replicator = tb3.shards.Replicator('a', self.repos['a'], self.shardmap)
+        replicator.pull(self.shardmap.get_platforms())
+        self.assertEqual(self.__get_commit_state('a', 'windows'), 'BAD')
+        self.assertEqual(tb3.repostate.RepoState('windows', 'master', self.repos['a']).get_first_bad(), self.head)
+        # the owner is not overwritten by foreign state
+        self.assertEqual(self.__get_commit_state('a', 'linux'), 'GOOD')
+        tb3.repostate.RepoState('windows', 'master', self.repos['b']).clear_first_bad()
+        replicator.pull(['windows'])
+        self.assertEqual(tb3.repostate.RepoState('windows', 'master', self.repos['a']).get_first_bad(), None)
+    def test_pull_empty(self):
+        tb3.shards.Replicator('a', self.repos['a'], self.shardmap).pull(self.shardmap.get_platforms())
+        self.assertEqual(self.__get_commit_state('a', 'windows'), 'UNKNOWN')
+    def test_push(self):
+        self.__finish('a', 'linux', 'GOOD')
+        self.__finish('b', 'windows', 'BAD')
+        tb3.shards.Replicator('a', self.repos['a'], self.shardmap).push(self.shardmap.get_platforms())
+        self.assertEqual(self.__get_commit_state('b', 'linux'), 'GOOD')
+        self.assertEqual(tb3.repostate.RepoState('linux', 'master', self.repos['b']).get_last_good(), self.head)
+        self.assertEqual(self.__get_commit_state('b', 'windows'), 'BAD')
+    def test_push_deleted(self):
+        self.__finish('a', 'linux', 'BAD')
+        replicator = tb3.shards.Replicator('a', self.repos['a'], self.shardmap)
+        replicator.push(['linux'])
+        self.assertEqual(tb3.repostate.RepoState('linux', 'master', self.repos['b']).get_first_bad(), self.head)
+        tb3.repostate.RepoState('linux', 'master', self.repos['a']).clear_first_bad()
+        replicator.push(['linux'])
+        self.assertEqual(tb3.repostate.RepoState('linux', 'master', self.repos['b']).get_first_bad(), None)
+        self.assertEqual(tb3.repostate.RepoState('linux', 'master', self.repos['b']).get_last_bad(), self.head)
+    def test_unreachable(self):
+        self.__finish('a', 'linux', 'GOOD')
+        self.__finish('b', 'windows', 'BAD')
+        repos = dict(self.repos, c=os.path.join(self.shardsdir, 'missing'))
+        shardmap = tb3.shards.ShardMap(repos, {'linux' : 'a', 'windows' : 'b', 'macosx' : 'c'})
+        replicator = tb3.shards.Replicator('a', self.repos['a'], shardmap)
+        # the other peers are still replicated with
+        self.assertEqual(replicator.pull(shardmap.get_platforms()), ['c'])
+        self.assertEqual(self.__get_commit_state('a', 'windows'), 'BAD')
+        self.assertEqual(replicator.push(shardmap.get_platforms()), ['c'])
+        self.assertEqual(self.__get_commit_state('b', 'linux'), 'GOOD')
+        self.assertEqual(tb3.shards.Replicator('a', self.repos['a'], self.shardmap).push(['linux']), [])
+
+if __name__ == '__main__':
+    unittest.main()
+# vim: set et sw=4 ts=4: